@@ -58,6 +58,11 @@ conf.registerGlobalValue(
     registry.NonNegativeInteger(2, """Number of seconds to wait after
     accepting a proposal before accepting another (prevents confusion
     by only accepting one proposal at a time)"""))
+conf.registerGlobalValue(
+    PulpTriage, 'idle_timeout',
+    registry.NonNegativeInteger(900, """Number of seconds a triaging user
+    can go without speaking in the triage channel before they no longer count
+    toward the quorum. Set to 0 to disable idle timeouts."""))
 conf.registerGlobalValue(
     PulpTriage, 'report_id',
     registry.NonNegativeInteger(134, """ID of the Redmine report containing
@@ -27,7 +27,9 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 ###
+import threading
 import time
+from collections import OrderedDict
 from functools import wraps
 
 import supybot.utils as utils  # NOQA
@@ -47,7 +49,9 @@ def wrap_chair(func, *args, **kwargs):
     # after the function definition to wrap the function
     @wraps(func)
     def wrapped(self, irc, msg, *wrapped_args, **wrapped_kwargs):
-        if msg.nick not in self.chairs:
+        with self._presence_lock:
+            is_chair = msg.nick in self.chairs
+        if not is_chair:
             irc.error('You are not the meeting chair.', private=True)
         else:
             return func(self, irc, msg, *wrapped_args, **wrapped_kwargs)
@@ -68,28 +72,36 @@ class PulpTriage(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(PulpTriage, self)
         self.__parent.__init__(irc)
+        # commands run in worker threads, but channel events are handled in the driver thread,
+        # so anything those events touch (triagers, chairs, carers) is guarded by this lock
+        self._presence_lock = threading.RLock()
         self._reset()
         self._last_proposal_time = time.time()
 
     def _reset(self):
-        # current issue being triaged
-        self.current_issue = None
-        # nicks participating in the current triage
-        self.triagers = set()
-        # issues that have already been seen, useful for managing deferred and skipped issues
-        self.seen = set()
-        # issues that have been deferred, should get handled after all other issues are seen
-        self.deferred = set()
-        # dict of issues that nicks care about, key is issue int, value is a set of nicks
-        self.carers = {}
-        # if set, proposal should be a tuple of ('action', 'string'),
-        # where action is one of the strings handled in accept,
-        # and string is a human-readable description of the action proposed.
-        self.proposal = None
-        # current list of issues in the triage issues list from redmine
-        self.triage_issues = None
-        # set of meeting chair nicks
-        self.chairs = set()
+        with self._presence_lock:
+            # current issue being triaged
+            self.current_issue = None
+            # channel the current triage is being held in, None if no triage is running
+            self.channel = None
+            # nicks present for the current triage, key is nick, value is the time they were
+            # last active; ordered oldest activity first, so idle triagers can be expired from
+            # the front
+            self.triagers = OrderedDict()
+            # issues that have already been seen, useful for managing deferred and skipped issues
+            self.seen = set()
+            # issues that have been deferred, should get handled after all other issues are seen
+            self.deferred = set()
+            # dict of issues that nicks care about, key is issue int, value is a set of nicks
+            self.carers = {}
+            # if set, proposal should be a tuple of ('action', 'string'),
+            # where action is one of the strings handled in accept,
+            # and string is a human-readable description of the action proposed.
+            self.proposal = None
+            # current list of issues in the triage issues list from redmine
+            self.triage_issues = None
+            # set of meeting chair nicks
+            self.chairs = set()
 
     # command funcs
 
@@ -133,7 +145,8 @@ class PulpTriage(callbacks.Plugin):
 
         This is generally only useful when the existing chair disappears for some reason, and
         someone needs to take over."""
-        self.chairs.add(nick)
+        with self._presence_lock:
+            self.chairs.add(nick)
         # this is broken, see the comment in addchair
         # self._meetbot_addchair(irc, msg, args)
 
@@ -153,7 +166,8 @@ class PulpTriage(callbacks.Plugin):
         discussion, users that !care about it will be pinged by nick."""
         for issue_id in issue_ids:
             if self.triage_issues and issue_id in self.triage_issues:
-                self.carers.setdefault(issue_id, set()).add(msg.nick)
+                with self._presence_lock:
+                    self.carers.setdefault(issue_id, set()).add(msg.nick)
 
     def defer(self, irc, msg, args):
         """(chair only)
@@ -184,13 +198,9 @@ class PulpTriage(callbacks.Plugin):
 
         Records a note in the meeting minutes that you are present for this triage session.
         The meeting chair and anyone participating using triage bot commands should be
-        automatically added."""
-        if msg.nick not in self.triagers:
-            self.triagers.add(msg.nick)
-            join_msg = "%s has joined triage" % msg.nick
-            self._meetbot_info(irc, msg, [join_msg])
-            irc.reply(join_msg)
-        else:
+        automatically added. Triagers that leave the channel or go idle are removed, and need
+        to !here again to be counted toward the quorum."""
+        if not self._triager_join(irc, msg):
             irc.reply('You have already joined this triage session.', private=True)
 
     @wrap(['text'])
@@ -204,7 +214,11 @@ class PulpTriage(callbacks.Plugin):
         """(chair only)
 
         Advance to the next triage issue if a quorum is present."""
-        # check the quorum
+        # check the quorum, after dropping anyone who has gone idle. the chair is
+        # obviously active, so make sure they aren't expired by their own command; this
+        # only goes in the minutes, announcing it would land in the middle of next's output
+        self._triager_join(irc, msg, reply=False)
+        self._expire_idle_triagers(irc, msg)
         if not self._quorum:
             irc.error('No quorum, more triagers need to !here to proceed.')
             return
@@ -238,7 +252,9 @@ class PulpTriage(callbacks.Plugin):
 
         Start an IRC triage session. The person calling start becomes a meeting chair."""
         self._reset()
-        self.chairs.add(msg.nick)
+        self.channel = msg.args[0]
+        with self._presence_lock:
+            self.chairs.add(msg.nick)
         self._meetbot_startmeeting(irc, msg, the_rest)
         self._refresh_triage_issues(irc)
 
@@ -252,7 +268,108 @@ class PulpTriage(callbacks.Plugin):
     @property
     def _quorum(self):
         quorum_count = self.registryValue('quorum_count')
-        return len(self.triagers) >= quorum_count
+        with self._presence_lock:
+            return len(self.triagers) >= quorum_count
+
+    # presence tracking
+
+    def _triager_refresh(self, nick, join=False):
+        # give nick a fresh activity time, moving them to the back of the line. nicks that
+        # aren't present are only added if join is set. returns True if nick was already present.
+        with self._presence_lock:
+            present = self.triagers.pop(nick, None) is not None
+            if present or join:
+                self.triagers[nick] = time.time()
+        return present
+
+    def _triager_join(self, irc, msg, reply=True):
+        # mark msg.nick present and active, announcing them if they weren't already present.
+        # returns True if the nick has just joined.
+        joined = not self._triager_refresh(msg.nick, join=True)
+        if joined:
+            join_msg = "%s has joined triage" % msg.nick
+            self._meetbot_record(irc, msg, "#info", [join_msg])
+            if reply:
+                irc.reply(join_msg)
+        return joined
+
+    def _triager_leave(self, irc, msg, nick, reason):
+        # remove a nick from the triagers, noting their departure in the meeting minutes
+        with self._presence_lock:
+            present = self.triagers.pop(nick, None) is not None
+        if present:
+            self._meetbot_left(irc, msg, nick, reason)
+
+    def _expire_idle_triagers(self, irc, msg):
+        # triagers are ordered by last activity, so only the stale ones at the front are visited
+        idle_timeout = self.registryValue('idle_timeout')
+        if not idle_timeout:
+            return
+        cutoff = time.time() - idle_timeout
+        expired = []
+        with self._presence_lock:
+            while self.triagers:
+                nick = next(iter(self.triagers))
+                if self.triagers[nick] > cutoff:
+                    break
+                del self.triagers[nick]
+                expired.append(nick)
+        for nick in expired:
+            self._meetbot_left(irc, msg, nick, 'idle')
+
+    def _in_triage_channel(self, channel):
+        return self.channel is not None and ircutils.strEqual(channel, self.channel)
+
+    # channel events
+
+    def doPrivmsg(self, irc, msg):
+        # talking in the triage channel keeps a triager from going idle,
+        # but lurkers have to !here (or use a triage command) to join
+        if self._in_triage_channel(msg.args[0]):
+            self._triager_refresh(msg.nick)
+
+    def doJoin(self, irc, msg):
+        # a chair coming back is running the meeting, so is present again right away;
+        # everyone else has to rejoin triage explicitly
+        with self._presence_lock:
+            is_chair = msg.nick in self.chairs
+        if not is_chair:
+            return
+        for channel in msg.args[0].split(','):
+            if self._in_triage_channel(channel):
+                self._triager_join(irc, msg, reply=False)
+
+    def doPart(self, irc, msg):
+        for channel in msg.args[0].split(','):
+            if self._in_triage_channel(channel):
+                self._triager_leave(irc, msg, msg.nick, 'parted')
+
+    def doKick(self, irc, msg):
+        channel, nick = msg.args[:2]
+        if self._in_triage_channel(channel):
+            self._triager_leave(irc, msg, nick, 'kicked')
+
+    def doQuit(self, irc, msg):
+        if self.channel is not None:
+            self._triager_leave(irc, msg, msg.nick, 'quit')
+
+    def doNick(self, irc, msg):
+        old_nick, new_nick = msg.nick, msg.args[0]
+        with self._presence_lock:
+            if old_nick in self.chairs:
+                self.chairs.discard(old_nick)
+                self.chairs.add(new_nick)
+            for care_nicks in self.carers.values():
+                if old_nick in care_nicks:
+                    care_nicks.discard(old_nick)
+                    care_nicks.add(new_nick)
+            # a nick change is activity, so the renamed triager moves to the back of the line
+            renamed = self.triagers.pop(old_nick, None) is not None
+            if renamed:
+                self.triagers[new_nick] = time.time()
+        if renamed:
+            self._meetbot_record(irc, msg, "#info",
+                                 ["%s is now known as %s" % (old_nick, new_nick)])
 
     # subcommands
     class Propose(callbacks.Commands):
@@ -363,17 +480,22 @@ class PulpTriage(callbacks.Plugin):
         # new_command is a meetbot command string, e.g. "#action user needs to do foo"
         # if args is passed, it needs to be a list.
         # args items will get stringified and concatenated to the new command
+        self._meetbot_record(irc, msg, new_command, args)
+
+        # anyone participating in triage implicitly joins
+        self._triager_join(irc, msg)
+
+    def _meetbot_record(self, irc, msg, new_command, args=None):
+        # like _meetbot_call, but without joining msg.nick to triage, for use when msg
+        # isn't from a participant (e.g. channel events) or the meeting is ending
         if args:
             # "#command arg arg arg"
             new_command += ' ' + ' '.join(map(str, args))
         meet_bot = irc.getCallback('MeetBot')
-        new_msg = IrcMsg(prefix='', args=(msg.args[0], new_command), msg=msg)
+        channel = self.channel or msg.args[0]
+        new_msg = IrcMsg(prefix='', command='PRIVMSG', args=(channel, new_command), msg=msg)
         meet_bot.doPrivmsg(irc, new_msg)
 
-        # anyone participating in triage implicitly joins
-        if msg.nick not in self.triagers:
-            self.here(irc, msg, [])
-
     def _meetbot_meeting(self, irc, msg):
         import MeetBot
         reload(MeetBot)
@@ -396,8 +518,11 @@ class PulpTriage(callbacks.Plugin):
     def _meetbot_agreed(self, irc, msg, args):
         self._meetbot_call(irc, msg, "#agreed", args)
 
+    def _meetbot_left(self, irc, msg, nick, reason):
+        self._meetbot_record(irc, msg, "#info", ["%s has left triage (%s)" % (nick, reason)])
+
     def _meetbot_endmeeting(self, irc, msg):
-        self._meetbot_call(irc, msg, "#endmeeting")
+        self._meetbot_record(irc, msg, "#endmeeting")
 
     def _meetbot_info(self, irc, msg, args):
         self._meetbot_call(irc, msg, "#info", args)
@@ -451,8 +576,9 @@ class PulpTriage(callbacks.Plugin):
 
             # after printing the bug, check to see who explicitly cares
             # this is a bit of a weird place to put this, but works alright
-            if self.current_issue in self.carers:
-                care_nicks = ', '.join(sorted(self.carers[self.current_issue]))
+            with self._presence_lock:
+                care_nicks = ', '.join(sorted(self.carers.get(self.current_issue, ())))
+            if care_nicks:
                 irc.reply('%s: Issue %d is currently being discussed.' % (care_nicks,
                                                                           self.current_issue))
 
@@ -28,6 +28,8 @@
 
 ###
 
+import time
+
 from supybot.test import *
 
 
@@ -35,4 +37,104 @@ class PulpTriageTestCase(PluginTestCase):
     plugins = ('PulpTriage',)
 
 
+foo = 'foo!foo@example.com'
+bar = 'bar!bar@example.com'
+
+
+class PulpTriagePresenceTestCase(ChannelPluginTestCase):
+    plugins = ('PulpTriage',)
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.triage = self.irc.getCallback('PulpTriage')
+        self.triage.channel = self.channel
+        # MeetBot isn't loaded here, so collect the minutes instead
+        self.minutes = []
+        def record(irc, msg, command, args=None):
+            self.minutes.append((command, args))
+        self.triage._meetbot_record = record
+
+    def _present(self, *nicks):
+        for nick in nicks:
+            self.triage._triager_refresh(nick, join=True)
+
+    def testPartQuitKickRemoveTriagers(self):
+        self._present('foo', 'bar', 'baz')
+        self.irc.feedMsg(ircmsgs.part(self.channel, prefix=foo))
+        self.irc.feedMsg(ircmsgs.quit(prefix=bar))
+        self.irc.feedMsg(ircmsgs.kick(self.channel, 'baz', prefix=self.prefix))
+        self.assertEqual(list(self.triage.triagers), [])
+        self.assertEqual(self.minutes, [
+            ('#info', ['foo has left triage (parted)']),
+            ('#info', ['bar has left triage (quit)']),
+            ('#info', ['baz has left triage (kicked)']),
+        ])
+
+    def testPartOtherChannel(self):
+        self._present('foo')
+        self.irc.feedMsg(ircmsgs.part('#elsewhere', prefix=foo))
+        self.assertEqual(list(self.triage.triagers), ['foo'])
+
+    def testNickCarriesOver(self):
+        self._present('foo')
+        self.triage.chairs.add('foo')
+        self.triage.carers[1234] = set(['foo'])
+        self.irc.feedMsg(ircmsgs.nick('foo_', prefix=foo))
+        self.assertEqual(list(self.triage.triagers), ['foo_'])
+        self.assertEqual(self.triage.chairs, set(['foo_']))
+        self.assertEqual(self.triage.carers[1234], set(['foo_']))
+        self.assertEqual(self.minutes,
+                         [('#info', ['foo is now known as foo_'])])
+
+    def testChairJoinIsPresent(self):
+        self.triage.chairs.add('foo')
+        self.irc.feedMsg(ircmsgs.join(self.channel, prefix=foo))
+        self.irc.feedMsg(ircmsgs.join(self.channel, prefix=bar))
+        self.assertEqual(list(self.triage.triagers), ['foo'])
+        self.assertEqual(self.minutes, [('#info', ['foo has joined triage'])])
+
+    def _age(self, nick, seconds):
+        # make nick look like they haven't been active for a while
+        self.triage.triagers[nick] = time.time() - seconds
+
+    def testNextJoinsChairSilently(self):
+        self.triage.chairs.add(self.nick)
+        # only the chair is present, so next fails the quorum check, and that
+        # error is the first reply rather than a join announcement
+        self.assertError('next')
+        self.assertEqual(list(self.triage.triagers), [self.nick])
+        self.assertIn(('#info', ['%s has joined triage' % self.nick]),
+                      self.minutes)
+
+    def testNextExpiresIdleTriagers(self):
+        idle_timeout = conf.supybot.plugins.PulpTriage.idle_timeout
+        self.triage.chairs.add(self.nick)
+        self._present('foo', self.nick)
+        self._age('foo', idle_timeout() + 1)
+        self._age(self.nick, idle_timeout() + 1)
+        self.assertError('next')
+        # the chair is refreshed by their own command, so only foo goes idle
+        self.assertEqual(list(self.triage.triagers), [self.nick])
+        self.assertEqual(self.minutes,
+                         [('#info', ['foo has left triage (idle)'])])
+
+    def testIdleTimeoutDisabled(self):
+        idle_timeout = conf.supybot.plugins.PulpTriage.idle_timeout
+        quorum_count = conf.supybot.plugins.PulpTriage.quorum_count
+        original_timeout, original_quorum = idle_timeout(), quorum_count()
+        idle_timeout.setValue(0)
+        # more than will be present, so next still fails the quorum check
+        quorum_count.setValue(3)
+        try:
+            self.triage.chairs.add(self.nick)
+            self._present('foo', self.nick)
+            self._age('foo', original_timeout + 1)
+            self.assertError('next')
+        finally:
+            idle_timeout.setValue(original_timeout)
+            quorum_count.setValue(original_quorum)
+        self.assertEqual(list(self.triage.triagers), ['foo', self.nick])
+        self.assertEqual(self.minutes, [])
+
+
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: